@@ -4,56 +4,182 @@ Vercel serverless function for market research cron job
 """
 
 import asyncio
+import logging
 import sys
 import os
-import json
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler
+
+try:
+    import orjson
+
+    _dumps = orjson.dumps
+except ImportError:
+    import json
+
+    def _dumps(obj):
+        return json.dumps(obj).encode()
+
+try:
+    import xxhash
+
+    def _digest(text):
+        return xxhash.xxh64_intdigest(text.encode())
+except ImportError:
+    import hashlib
+
+    def _digest(text):
+        return hashlib.blake2b(text.encode(), digest_size=8).digest()
+
+try:
+    import uvloop as fast_loop
+except ImportError:
+    fast_loop = None
 
 # Add the parent directory to sys.path to import our modules
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
 try:
     from market_research_agent import MarketResearchAgent
-    from email_sender import EmailSender
+    from email_sender import EmailCfg, EmailSender
     from slack_sender import SlackSender
+    from http_client import warm
 except ImportError as e:
-    print(f"Import error: {e}")
+    logging.getLogger(__name__).warning("Import error: %s", e)
     # For testing purposes, create mock classes
     class MarketResearchAgent:
         async def analyze_market(self): return "Mock analysis"
         def format_email_content(self, analysis): return f"<html><body>{analysis}</body></html>"
+        def render(self, analysis): return {"subject": "Mock report", "html": self.format_email_content(analysis), "slack": analysis}
+    class EmailCfg:
+        @staticmethod
+        def from_env(): return None
     class EmailSender:
+        def __init__(self, cfg=None): pass
         def send(self, subject, content): return True
+        async def send_async(self, subject, content): return True
     class SlackSender:
         def send(self, message): return True
+        async def send_async(self, message): return True
+    async def warm(*urls): pass
+
+
+# One event loop for the life of the process instead of one per invocation.
+# The lock serializes invocations in case the runtime calls us from threads.
+_LOOP = fast_loop.new_event_loop() if fast_loop else asyncio.new_event_loop()
+_LOOP.set_default_executor(ThreadPoolExecutor(max_workers=4))
+_LOOP_LOCK = threading.Lock()
+
+log = logging.getLogger(__name__)
+if os.environ.get("DEBUG"):
+    # Handlers are the runtime's business; only lower this module's threshold
+    log.setLevel(logging.INFO)
+
+# Neither of these can change during the life of the process
+_SLACK_ENABLED = bool(os.environ.get("SLACK_BOT_TOKEN"))
+_CFG = EmailCfg.from_env()
+
+# Hosts whose connections are opened while the analysis is still running
+_WARM_URLS = tuple(
+    url for url, enabled in (
+        ("https://api.sendgrid.com/", _CFG is not None and bool(_CFG.sendgrid_key)),
+        ("https://slack.com/api/", _SLACK_ENABLED),
+    ) if enabled
+)
+
+# Reused across invocations while the function instance stays warm
+_AGENT = None
+_EMAIL = None
+_SLACK = None
+
+
+def _get_agent():
+    global _AGENT
+    _AGENT = _AGENT or MarketResearchAgent()
+    return _AGENT
+
+
+def _get_email_sender():
+    """Return the shared EmailSender, or None when only Slack is configured"""
+    global _EMAIL
+    if _EMAIL is None and (_CFG is None or _CFG.has_transport or not _SLACK_ENABLED):
+        # With no notification channel at all, EmailSender's ValueError fails the run
+        _EMAIL = EmailSender(_CFG)
+    return _EMAIL
+
+
+def _get_slack_sender():
+    """Return the shared SlackSender, or None when Slack isn't configured"""
+    global _SLACK
+    if _SLACK_ENABLED and _SLACK is None:
+        _SLACK = SlackSender()
+    return _SLACK
+
+
+# Rendered payloads keyed by analysis digest, so retries skip the rerender
+_RENDER_CACHE = {}
+_RENDER_CACHE_SIZE = 4
+
+
+def _render(agent, analysis):
+    key = _digest(analysis)
+    rendered = _RENDER_CACHE.get(key)
+    if rendered is None:
+        rendered = agent.render(analysis)
+        if len(_RENDER_CACHE) >= _RENDER_CACHE_SIZE:
+            # Dicts keep insertion order, so this evicts the oldest entry
+            del _RENDER_CACHE[next(iter(_RENDER_CACHE))]
+        _RENDER_CACHE[key] = rendered
+    return rendered
 
 
 async def run_market_research():
     """Run the complete market research workflow"""
-    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    print(f"Market Research Agent - {timestamp}")
+    timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+    log.info("Market Research Agent - %s", timestamp)
     
     try:
-        # Initialize agent
-        agent = MarketResearchAgent()
+        # Initialize agent and senders; a misconfigured notification setup fails
+        # here, before the expensive analysis runs
+        agent = _get_agent()
+        email_sender = _get_email_sender()
+        
+        # Handshake with the notification hosts while the analysis runs
+        warm_task = asyncio.create_task(warm(*_WARM_URLS))
         
         # Collect and analyze market data
-        print("Starting market analysis...")
+        log.info("Starting market analysis...")
         analysis = await agent.analyze_market()
+        await warm_task
         
         # Send notifications
-        print("Sending notifications...")
-        email_content = agent.format_email_content(analysis)
-        email_sender = EmailSender()
-        subject = "Daily Market Research Report"
+        log.info("Sending notifications...")
+        rendered = _render(agent, analysis)
         
-        email_success = email_sender.send(subject, email_content)
+        # Email and Slack are independent, so send them concurrently
+        if email_sender is not None:
+            email_task = email_sender.send_async(rendered["subject"], rendered["html"])
+        else:
+            email_task = asyncio.sleep(0, result=False)
         
         # Send to Slack (if configured)
-        slack_success = True
-        slack_sender = SlackSender()
-        if os.getenv("SLACK_BOT_TOKEN"):
-            slack_success = slack_sender.send(analysis)
+        slack_sender = _get_slack_sender()
+        if slack_sender is not None:
+            slack_task = slack_sender.send_async(rendered["slack"])
+        else:
+            slack_task = asyncio.sleep(0, result=True)
+        
+        email_success, slack_success = await asyncio.gather(
+            email_task, slack_task, return_exceptions=True
+        )
+        if isinstance(email_success, Exception):
+            log.error("Error sending email: %s", email_success)
+            email_success = False
+        if isinstance(slack_success, Exception):
+            log.error("Error sending Slack message: %s", slack_success)
+            slack_success = False
         
         return {
             "success": True,
@@ -64,9 +190,7 @@ async def run_market_research():
         }
         
     except Exception as e:
-        print(f"Error running market research: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("Error running market research: %s", e)
         return {
             "success": False,
             "timestamp": timestamp,
@@ -75,29 +199,56 @@ async def run_market_research():
         }
 
 
-def handler(event, context):
-    """Vercel serverless function handler"""
+_JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+def _invoke():
+    """Run the workflow on the shared loop and return (status code, JSON body bytes)"""
     try:
         # Run the market research
-        result = asyncio.run(run_market_research())
+        with _LOOP_LOCK:
+            result = _LOOP.run_until_complete(run_market_research())
         
-        return {
-            'statusCode': 200 if result['success'] else 500,
-            'headers': {
-                'Content-Type': 'application/json'
-            },
-            'body': json.dumps(result)
-        }
+        return 200 if result['success'] else 500, _dumps(result)
         
     except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Content-Type': 'application/json'
-            },
-            'body': json.dumps({
-                "success": False,
-                "error": str(e),
-                "message": "Internal server error"
-            })
-        }
+        return 500, _dumps({
+            "success": False,
+            "error": str(e),
+            "message": "Internal server error"
+        })
+
+
+def lambda_handler(event, context):
+    """Vercel serverless function handler (event/context style)"""
+    status, body = _invoke()
+    return {
+        'statusCode': status,
+        'headers': _JSON_HEADERS,
+        # The event/context style expects a str body
+        'body': body.decode()
+    }
+
+
+class HTTPHandler(BaseHTTPRequestHandler):
+    """Vercel serverless function handler (BaseHTTPRequestHandler style)"""
+    
+    def do_GET(self):
+        status, body = _invoke()
+        self.send_response(status)
+        for name, value in _JSON_HEADERS.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    do_POST = do_GET
+
+
+def get_handler():
+    """Pick the handler style the deployment expects"""
+    if os.getenv("VERCEL_HANDLER_STYLE") == "http":
+        return HTTPHandler
+    return lambda_handler
+
+
+handler = get_handler()
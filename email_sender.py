@@ -4,40 +4,206 @@ Supports SendGrid and SMTP
 """
 
 import os
-from typing import Optional
-from dotenv import load_dotenv
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from datetime import datetime
+import asyncio
+import functools
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional
+from env import load_env
 
-load_dotenv()
+if TYPE_CHECKING:
+    import smtplib
+
+# smtplib, email.mime, dotenv and http_client (aiohttp) are imported on first
+# use to keep cold starts cheap when SendGrid is configured through the environment
+
+SENDGRID_API_URL = "https://api.sendgrid.com/v3/mail/send"
+
+
+class _SMTPPool:
+    """Keeps authenticated SMTP connections open between sends"""
+    
+    def __init__(self, size: int = 4, idle_timeout: float = 10.0):
+        self.idle_timeout = idle_timeout
+        # Entries are (key, connection, last_used) tuples
+        self._idle = queue.Queue(maxsize=size)
+        self._reaper = None
+        self._reaper_lock = threading.Lock()
+    
+    @contextmanager
+    def connection(self, smtp_server: str, smtp_port: int,
+                   smtp_username: Optional[str] = None,
+                   smtp_password: Optional[str] = None):
+        """Check out a live connection and return it to the pool afterwards"""
+        key = (smtp_server, smtp_port, smtp_username)
+        conn = self._checkout(key, smtp_password)
+        try:
+            yield conn
+        except Exception:
+            # The connection may be in an unknown state, so don't reuse it
+            self._close(conn)
+            raise
+        self._checkin(key, conn)
+    
+    def _checkout(self, key, smtp_password: Optional[str]) -> "smtplib.SMTP":
+        while True:
+            try:
+                conn_key, conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect(key, smtp_password)
+            if conn_key == key and self._is_alive(conn):
+                return conn
+            self._close(conn)
+    
+    def _checkin(self, key, conn: "smtplib.SMTP"):
+        try:
+            self._idle.put_nowait((key, conn, time.monotonic()))
+        except queue.Full:
+            self._close(conn)
+            return
+        with self._reaper_lock:
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap, name="smtp-reaper", daemon=True)
+                self._reaper.start()
+    
+    def _connect(self, key, smtp_password: Optional[str]) -> "smtplib.SMTP":
+        import smtplib
+        
+        smtp_server, smtp_port, smtp_username = key
+        conn = smtplib.SMTP(smtp_server, smtp_port)
+        try:
+            conn.starttls()
+            if smtp_username and smtp_password:
+                conn.login(smtp_username, smtp_password)
+        except Exception:
+            self._close(conn)
+            raise
+        return conn
+    
+    def _reap(self):
+        """Close connections that have been idle longer than idle_timeout"""
+        while True:
+            time.sleep(self.idle_timeout / 2)
+            now = time.monotonic()
+            kept = []
+            while True:
+                try:
+                    entry = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                if now - entry[2] > self.idle_timeout:
+                    self._close(entry[1])
+                else:
+                    kept.append(entry)
+            for entry in kept:
+                try:
+                    self._idle.put_nowait(entry)
+                except queue.Full:
+                    self._close(entry[1])
+            with self._reaper_lock:
+                if self._idle.empty():
+                    self._reaper = None
+                    return
+    
+    @staticmethod
+    def _is_alive(conn: "smtplib.SMTP") -> bool:
+        try:
+            return conn.noop()[0] == 250
+        except OSError:  # SMTPException subclasses OSError
+            return False
+    
+    @staticmethod
+    def _close(conn: "smtplib.SMTP"):
+        try:
+            conn.quit()
+        except OSError:  # SMTPException subclasses OSError
+            conn.close()
+
+
+_smtp_pool = _SMTPPool(size=8)
+
+
+@dataclass(frozen=True, slots=True)
+class EmailCfg:
+    """Email settings, read from the environment once per process"""
+    sendgrid_key: Optional[str]
+    from_email: Optional[str]
+    to_email: Optional[str]
+    smtp_user: Optional[str]
+    smtp_pass: Optional[str]
+    
+    @classmethod
+    def from_env(cls) -> "EmailCfg":
+        # FROM_EMAIL/TO_EMAIL may live only in .env; load_env() is a no-op after the first call
+        load_env()
+        
+        return cls(
+            sendgrid_key=os.getenv('SENDGRID_API_KEY'),
+            from_email=os.getenv('FROM_EMAIL'),
+            to_email=os.getenv('TO_EMAIL'),
+            # You can add SMTP credentials to .env if needed
+            smtp_user=os.getenv('SMTP_USERNAME', os.getenv('FROM_EMAIL')),
+            smtp_pass=os.getenv('SMTP_PASSWORD'),
+        )
+    
+    @property
+    def has_transport(self) -> bool:
+        """Whether SendGrid or SMTP credentials are present"""
+        return bool(self.sendgrid_key or self.smtp_pass)
 
 
 class EmailSender:
     """Handle email sending through SendGrid or SMTP"""
     
-    def __init__(self):
-        self.sendgrid_api_key = os.getenv('SENDGRID_API_KEY')
-        self.from_email = os.getenv('FROM_EMAIL')
-        self.to_email = os.getenv('TO_EMAIL')
+    def __init__(self, cfg: Optional[EmailCfg] = None):
+        cfg = cfg or EmailCfg.from_env()
+        # Fail at startup rather than after a full market analysis
+        if not cfg.has_transport:
+            raise ValueError("No email configuration found. Set SENDGRID_API_KEY or SMTP_PASSWORD.")
+        if not (cfg.from_email and cfg.to_email):
+            raise ValueError("FROM_EMAIL and TO_EMAIL must be set.")
+        
+        self.sendgrid_api_key = cfg.sendgrid_key
+        self.from_email = cfg.from_email
+        self.to_email = cfg.to_email
+        # TO_EMAIL may be a comma-separated list; each recipient gets their own copy
+        self.to_emails = [e.strip() for e in (self.to_email or '').split(',') if e.strip()]
+        
+        # Only subject and content change between SendGrid sends
+        self._body_template = {
+            "personalizations": [{"to": [{"email": to}]} for to in self.to_emails],
+            "from": {"email": self.from_email},
+            "subject": None,
+            "content": None,
+        }
+        self._sendgrid_client = None
+        
+        # Pick the transport once rather than re-checking the env on every send
+        if self.sendgrid_api_key:
+            self._send_impl = self.send_sendgrid
+            self._send_async_impl = self.send_sendgrid_async
+        else:
+            self._send_async_impl = self._send_in_thread
+            print("SendGrid API key not found. Use SMTP configuration.")
+            self._send_impl = functools.partial(self.send_smtp,
+                                                smtp_username=cfg.smtp_user,
+                                                smtp_password=cfg.smtp_pass)
         
     def send_sendgrid(self, subject: str, html_content: str) -> bool:
         """Send email using SendGrid"""
         try:
-            from sendgrid import SendGridAPIClient
-            from sendgrid.helpers.mail import Mail
+            if self._sendgrid_client is None:
+                from sendgrid import SendGridAPIClient
+                self._sendgrid_client = SendGridAPIClient(self.sendgrid_api_key)
             
-            message = Mail(
-                from_email=self.from_email,
-                to_emails=self.to_email,
-                subject=subject,
-                html_content=html_content
+            response = self._sendgrid_client.client.mail.send.post(
+                request_body=self._build_sendgrid_body(subject, html_content)
             )
             
-            sg = SendGridAPIClient(self.sendgrid_api_key)
-            response = sg.send(message)
-            
             print(f"Email sent successfully! Status code: {response.status_code}")
             return True
             
@@ -45,28 +211,46 @@ class EmailSender:
             print(f"Error sending email via SendGrid: {e}")
             return False
     
+    def _build_sendgrid_body(self, subject: str, html_content: str) -> dict:
+        body = self._body_template.copy()
+        body["subject"] = subject
+        body["content"] = [{"type": "text/html", "value": html_content}]
+        return body
+    
+    async def send_sendgrid_async(self, subject: str, html_content: str) -> bool:
+        """Send email using the SendGrid REST API without blocking the event loop"""
+        from http_client import get_session
+        
+        try:
+            body = self._build_sendgrid_body(subject, html_content)
+            headers = {"Authorization": f"Bearer {self.sendgrid_api_key}"}
+            
+            async with get_session().post(SENDGRID_API_URL, json=body, headers=headers) as response:
+                response.raise_for_status()
+                print(f"Email sent successfully! Status code: {response.status}")
+                return True
+            
+        except Exception as e:
+            print(f"Error sending email via SendGrid: {e}")
+            return False
+    
     def send_smtp(self, subject: str, html_content: str, 
                   smtp_server: str = "smtp.gmail.com", 
                   smtp_port: int = 587,
                   smtp_username: Optional[str] = None,
                   smtp_password: Optional[str] = None) -> bool:
         """Send email using SMTP (fallback option)"""
+        def send_one(to_email: str):
+            self._send_smtp_one(to_email, subject, html_content, smtp_server,
+                                smtp_port, smtp_username, smtp_password)
+        
         try:
-            msg = MIMEMultipart('alternative')
-            msg['Subject'] = subject
-            msg['From'] = self.from_email
-            msg['To'] = self.to_email
-            
-            # Create HTML part
-            html_part = MIMEText(html_content, 'html')
-            msg.attach(html_part)
-            
-            # Send email
-            with smtplib.SMTP(smtp_server, smtp_port) as server:
-                server.starttls()
-                if smtp_username and smtp_password:
-                    server.login(smtp_username, smtp_password)
-                server.send_message(msg)
+            if len(self.to_emails) == 1:
+                send_one(self.to_emails[0])
+            else:
+                # Fan out over recipients; each worker checks out its own pooled connection
+                with ThreadPoolExecutor(max_workers=min(8, len(self.to_emails))) as executor:
+                    list(executor.map(send_one, self.to_emails))
             
             print("Email sent successfully via SMTP!")
             return True
@@ -75,19 +259,35 @@ class EmailSender:
             print(f"Error sending email via SMTP: {e}")
             return False
     
+    def _send_smtp_one(self, to_email: str, subject: str, html_content: str,
+                       smtp_server: str, smtp_port: int,
+                       smtp_username: Optional[str],
+                       smtp_password: Optional[str]):
+        from email.mime.text import MIMEText
+        from email.mime.multipart import MIMEMultipart
+        
+        msg = MIMEMultipart('alternative')
+        msg['Subject'] = subject
+        msg['From'] = self.from_email
+        msg['To'] = to_email
+        
+        # Create HTML part
+        html_part = MIMEText(html_content, 'html')
+        msg.attach(html_part)
+        
+        # Send email over a pooled, already-authenticated connection
+        with _smtp_pool.connection(smtp_server, smtp_port,
+                                   smtp_username, smtp_password) as server:
+            server.send_message(msg)
+    
+    async def _send_in_thread(self, subject: str, html_content: str) -> bool:
+        # smtplib is blocking, so run the fallback path in a worker thread
+        return await asyncio.to_thread(self._send_impl, subject, html_content)
+    
     def send(self, subject: str, html_content: str) -> bool:
         """Send email using available method"""
-        if self.sendgrid_api_key:
-            return self.send_sendgrid(subject, html_content)
-        else:
-            print("SendGrid API key not found. Use SMTP configuration.")
-            # You can add SMTP credentials to .env if needed
-            smtp_username = os.getenv('SMTP_USERNAME', self.from_email)
-            smtp_password = os.getenv('SMTP_PASSWORD')
-            if smtp_password:
-                return self.send_smtp(subject, html_content, 
-                                    smtp_username=smtp_username,
-                                    smtp_password=smtp_password)
-            else:
-                print("No email configuration found.")
-                return False
\ No newline at end of file
+        return self._send_impl(subject, html_content)
+    
+    async def send_async(self, subject: str, html_content: str) -> bool:
+        """Send email using available method without blocking the event loop"""
+        return await self._send_async_impl(subject, html_content)
\ No newline at end of file
@@ -0,0 +1,15 @@
+"""
+Environment loading shared by the agent and the notification senders
+"""
+
+_loaded = False
+
+
+def load_env():
+    """Parse .env into os.environ once per process, whichever module asks first"""
+    global _loaded
+    if not _loaded:
+        # Imported here so callers that never need .env don't pay for dotenv
+        from dotenv import load_dotenv
+        load_dotenv()
+        _loaded = True
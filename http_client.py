@@ -0,0 +1,69 @@
+"""
+Shared HTTP session for outbound notification calls (SendGrid and Slack)
+"""
+
+import asyncio
+import atexit
+from typing import Dict
+import aiohttp
+
+try:
+    import orjson
+
+    def _json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+except ImportError:
+    import json
+    _json_dumps = json.dumps
+
+# aiohttp sessions are bound to the loop they were created on, so keep one per loop
+_SESSIONS: Dict[asyncio.AbstractEventLoop, aiohttp.ClientSession] = {}
+
+
+def get_session() -> aiohttp.ClientSession:
+    """Return the shared session for the running event loop, creating it if needed"""
+    loop = asyncio.get_running_loop()
+    session = _SESSIONS.get(loop)
+    if session is None or session.closed:
+        # Forget sessions whose loops have already been closed
+        for stale_loop in [stale for stale in _SESSIONS if stale.is_closed()]:
+            del _SESSIONS[stale_loop]
+        # json= bodies (Slack chat.postMessage, SendGrid mail/send) go through orjson
+        session = aiohttp.ClientSession(
+            json_serialize=_json_dumps,
+            timeout=aiohttp.ClientTimeout(total=10),
+            connector=aiohttp.TCPConnector(limit=16, keepalive_timeout=30),
+        )
+        _SESSIONS[loop] = session
+    return session
+
+
+async def close_session():
+    """Close the running loop's shared session; await this before the loop shuts down"""
+    session = _SESSIONS.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+
+
+@atexit.register
+def _close_sessions():
+    """Close pooled connections cleanly when the process shuts down"""
+    for loop, session in _SESSIONS.items():
+        if not session.closed and not loop.is_closed() and not loop.is_running():
+            loop.run_until_complete(session.close())
+    _SESSIONS.clear()
+
+
+async def warm(*urls: str):
+    """Open pooled connections to the given hosts ahead of time; failures are ignored"""
+    session = get_session()
+
+    async def _head(url: str):
+        try:
+            async with session.head(url, timeout=aiohttp.ClientTimeout(total=2)):
+                pass
+        except Exception:
+            # Warming is best-effort; the real request will surface any error
+            pass
+
+    await asyncio.gather(*(_head(url) for url in urls))
@@ -5,20 +5,288 @@ Uses web scraping and Groq/LangChain for AI analysis
 
 import os
 import asyncio
+import itertools
+import time
 import aiohttp
-import markdown2
-from datetime import datetime, time
+from datetime import datetime
 from typing import Dict, List, Any
-import pandas as pd
-import yfinance as yf
-from bs4 import BeautifulSoup
-import requests
-from dotenv import load_dotenv
+from env import load_env
 from langchain_groq import ChatGroq
 from langchain.prompts import ChatPromptTemplate
-from langchain.chains import LLMChain
+from langchain_core.output_parsers import StrOutputParser
 
-load_dotenv()
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    import json
+    _json_loads = json.loads
+
+load_env()
+
+
+_PROMPT_TEMPLATE_STR = """You are a genius, insightful financial analyst with years of experience providing a morning market briefing for {current_date}. Your tone should be conversational yet informative, like a pro talking to colleagues.
+
+**Crucial Instructions:**
+- **DO NOT HALLUCINATE.** Use ONLY the data provided below. Do not invent facts, figures, or news.
+- If data for a section is unavailable, state "Data not available."
+- Your analysis must be insightful, connecting different data points.
+- The News section is critical. It should be the most in-depth, discussing 15-25 most important and interesting headlines (MAXIMUM 25 HEADLINES) DO NOT LIST MORE THAN 25 HEADLINES UNDER ANY CIRCUMSTANCE. DO NOT include earnings call transcripts in this section, or any other transcripts, we want interesting macro and market headlines.
+- Please try to include current prices for the major indices IF AVAILABLE.
+
+TO REPEAT:
+- NO EARNINGS CALL TRANSCRIPTS IN THE NEWS SECTION UNDER ANY CIRCUMSTANCE. IF IT HAS "earnings call transcript" OR SIMILAR IN THE HEADLINE DO NOT INCLUDE IT.
+- MAXIMUM 25 HEADLINES, CAREFULLY SELECT THE MOST INTERESTING AND IMPORTANT HEADLINES
+- Try to keep headlines that are most important and interesting to economic markets and geopolitics.
+
+WHEN DECIDING WHICH HEADLINES TO INCLUDE, CONSIDER THE FOLLOWING:
+- Is it a fact or opinion? Prioritize facts
+- Is it relevant to the market? Prioritize market-relevant news
+- Is it related to geopolitics and macroeconomic trends? Prioritize geopolitical news
+- Is it related to technology and innovation? Prioritize technology news
+- Is it related to consumer behavior and trends? Prioritize consumer news
+- Is it related to the economy and economy? Prioritize economy news
+AVOID:
+- Headlines that are questions
+- Headlines that don't necessarily highlight any market-moving information
+
+**Market Data for your analysis:**
+- **Headlines:**
+{headlines}
+- **Treasury Yields:**
+{formatted_yields}
+- **Market Benchmarks:**
+{formatted_benchmarks}
+- **MAJOR MOVERS:**
+{formatted_movers}
+
+**CRITICAL: You MUST use these EXACT section headers in your response:**
+- **📈 Markets:**
+- **📰 Top News:**
+- **🚀 Major Movers 📉:**
+- **💡 Key Takeaways:**
+- **📊 Overall Sentiment:**
+
+Please provide a detailed report in the style of a professional market briefing. Please avoid using charts or diagrams, instead just use markdown / plain speech.
+
+        """
+
+# Parsed once at import and shared by every agent instance
+_PROMPT_TEMPLATE = ChatPromptTemplate.from_template(_PROMPT_TEMPLATE_STR)
+
+
+# Placeholders are filled with str.format; literal CSS braces are doubled
+_EMAIL_TEMPLATE = """
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <meta charset="UTF-8">
+            <meta name="viewport" content="width=device-width, initial-scale=1.0">
+            <title>Market Research Report</title>
+            <style>
+                body {{
+                    font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Oxygen, Ubuntu, Cantarell, sans-serif;
+                    line-height: 1.6;
+                    color: #333;
+                    max-width: 800px;
+                    margin: 0 auto;
+                    padding: 20px;
+                    background-color: #f8f9fa;
+                }}
+                .header {{
+                    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+                    color: white;
+                    padding: 30px;
+                    border-radius: 10px;
+                    text-align: center;
+                    margin-bottom: 30px;
+                    box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
+                }}
+                .header h1 {{
+                    margin: 0;
+                    font-size: 28px;
+                    font-weight: 600;
+                }}
+                .header .date {{
+                    margin: 10px 0 0 0;
+                    font-size: 16px;
+                    opacity: 0.9;
+                }}
+                .content {{
+                    background: white;
+                    border-radius: 10px;
+                    padding: 30px;
+                    box-shadow: 0 2px 4px rgba(0, 0, 0, 0.1);
+                }}
+                .section {{
+                    margin-bottom: 30px;
+                    border-left: 4px solid #e9ecef;
+                    padding-left: 20px;
+                }}
+                .markets-section {{
+                    border-left-color: #28a745;
+                }}
+                .news-section {{
+                    border-left-color: #007bff;
+                }}
+                .movers-section {{
+                    border-left-color: #ffc107;
+                }}
+                .takeaways-section {{
+                    border-left-color: #17a2b8;
+                }}
+                .sentiment-section {{
+                    border-left-color: #6f42c1;
+                }}
+                .section-header {{
+                    color: #2c3e50;
+                    font-size: 20px;
+                    font-weight: 600;
+                    margin: 0 0 15px 0;
+                    padding-bottom: 8px;
+                    border-bottom: 2px solid #e9ecef;
+                }}
+                .section-content {{
+                    font-size: 14px;
+                }}
+                .market-item {{
+                    background: #f8f9fa;
+                    padding: 8px 12px;
+                    margin: 5px 0;
+                    border-radius: 5px;
+                    font-family: 'Monaco', 'Menlo', monospace;
+                    font-size: 13px;
+                    border-left: 3px solid #28a745;
+                }}
+                .bullet-point {{
+                    margin: 8px 0;
+                    padding-left: 15px;
+                    position: relative;
+                }}
+                .bullet-point:before {{
+                    content: "•";
+                    color: #007bff;
+                    font-weight: bold;
+                    position: absolute;
+                    left: 0;
+                }}
+                .content-paragraph {{
+                    margin: 12px 0;
+                    line-height: 1.7;
+                }}
+                .footer {{
+                    text-align: center;
+                    margin-top: 30px;
+                    padding: 20px;
+                    background: #f8f9fa;
+                    border-radius: 10px;
+                    font-size: 12px;
+                    color: #6c757d;
+                }}
+                .footer a {{
+                    color: #007bff;
+                    text-decoration: none;
+                }}
+            </style>
+        </head>
+        <body>
+            <div class="header">
+                <h1>📊 Market Research Report</h1>
+                <div class="date">{current_date_str}</div>
+            </div>
+            
+            <div class="content">
+                {content_html}
+            </div>
+            
+            <div class="footer">
+                <p>This report was generated automatically by your Market Research Agent.</p>
+                <p>Powered by Financial Modeling Prep API & Groq AI</p>
+            </div>
+        </body>
+        </html>
+        """
+
+
+# Joined once at import; the benchmarks quote request asks for all of them at once
+_BENCHMARK_SYMBOLS_CSV = ','.join([
+    # US Major Indices
+    '^GSPC',    # S&P 500
+    '^DJI',     # Dow Jones Industrial Average
+    '^IXIC',    # NASDAQ Composite
+    '^RUT',     # Russell 2000
+    '^VIX',     # Volatility Index
+    'SPY',     # S&P 500 ETF
+    
+
+    
+    # Global Indices
+    '^FTSE',    # FTSE 100 (UK)
+    '^N225',    # Nikkei 225 (Japan)
+    '^GDAXI',   # DAX (Germany)
+    '^FCHI',    # CAC 40 (France)
+    '^HSI',     # Hang Seng (Hong Kong)
+    '^AXJO',    # ASX 200 (Australia)
+    '^BVSP',    # Bovespa (Brazil)
+    '^MXX',     # IPC Mexico
+    
+    # Sector ETFs
+    'XLF',      # Financial Select Sector SPDR
+    'XLK',      # Technology Select Sector SPDR
+    'XLE',      # Energy Select Sector SPDR
+    'XLV',      # Health Care Select Sector SPDR
+    'XLI',      # Industrial Select Sector SPDR
+    'XLP',      # Consumer Staples Select Sector SPDR
+    'XLY',      # Consumer Discretionary Select Sector SPDR
+    'XLU',      # Utilities Select Sector SPDR
+    'XLRE',     # Real Estate Select Sector SPDR
+    'XLB',      # Materials Select Sector SPDR
+    
+    # Commodities
+    'CL=F',     # Crude Oil WTI
+    'BZ=F',     # Brent Crude Oil
+    'NG=F',     # Natural Gas
+    'GC=F',     # Gold
+    'SI=F',     # Silver
+    'HG=F',     # Copper
+    'PL=F',     # Platinum
+    'PA=F',     # Palladium
+    'ZC=F',     # Corn
+    'ZW=F',     # Wheat
+    'ZS=F',     # Soybeans
+    
+    # Currencies
+    'EURUSD=X', # EUR/USD
+    'GBPUSD=X', # GBP/USD
+    'USDJPY=X', # USD/JPY
+    'USDCAD=X', # USD/CAD
+    'AUDUSD=X', # AUD/USD
+    'USDCHF=X', # USD/CHF
+    'NZDUSD=X', # NZD/USD
+    'USDSEK=X', # USD/SEK
+    'USDNOK=X', # USD/NOK
+    'DX-Y.NYB', # US Dollar Index
+    
+    # Cryptocurrency
+    'BTC-USD',  # Bitcoin
+    'ETH-USD',  # Ethereum
+    'ADA-USD',  # Cardano
+    'SOL-USD',  # Solana
+
+    # Bonds & Fixed Income
+    'TLT',      # 20+ Year Treasury Bond ETF
+    'IEF',      # 7-10 Year Treasury Bond ETF
+    'SHY',      # 1-3 Year Treasury Bond ETF
+    'HYG',      # High Yield Corporate Bond ETF
+    'LQD',      # Investment Grade Corporate Bond ETF
+    'EMB',      # Emerging Markets Bond ETF
+    
+    # Alternative Assets
+    'REIT',     # iShares Core U.S. REIT ETF
+    'PDBC',     # Invesco Optimum Yield Diversified Commodity Strategy No K-1 ETF
+    'IAU',      # iShares Gold Trust
+    'SLV',      # iShares Silver Trust
+])
 
 
 class MarketDataCollector:
@@ -27,36 +295,113 @@ class MarketDataCollector:
     def __init__(self):
         self.session = None
         self.fmp_api_key = os.getenv('FMP_API_KEY')
+        # Loop time until which FMP has told us our quota is exhausted
+        self._limited_until = 0.0
 
     async def __aenter__(self):
+        # One keep-alive pool for every FMP request made during the run
+        connector = aiohttp.TCPConnector(limit=32, limit_per_host=8, ttl_dns_cache=300, keepalive_timeout=30)
         self.session = aiohttp.ClientSession(
-            headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+            connector=connector,
+            headers={
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+                # FMP compresses responses; the 60-symbol quote payload shrinks a lot
+                'Accept-Encoding': 'gzip, deflate',
+            }
         )
+        # Caps in-flight FMP requests so fanned-out fetches stay under the rate limit
+        self._sem = asyncio.Semaphore(8)
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         await self.session.close()
     
-    async def _fetch_with_retry(self, url, source):
+    def _note_rate_limit(self, response):
+        """Record when FMP's quota resets so later requests wait instead of hitting 429s"""
+        if response.status != 429 and response.headers.get('X-Rate-Limit-Remaining') != '0':
+            return
+        reset = response.headers.get('Retry-After') or response.headers.get('X-Rate-Limit-Reset')
+        try:
+            delay = float(reset)
+        except (TypeError, ValueError):
+            delay = 1.0
+        if delay > 1e9:  # An epoch timestamp rather than a number of seconds
+            delay -= time.time()
+        delay = min(max(delay, 0.0), 60.0)
+        print(f"FMP rate limit reached, pausing requests for {delay:.1f}s")
+        self._limited_until = max(self._limited_until, asyncio.get_running_loop().time() + delay)
+
+    async def _wait_for_rate_limit(self):
+        delay = self._limited_until - asyncio.get_running_loop().time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _fetch_with_retry(self, url, source, as_json=False):
         for attempt in range(3):
+            await self._wait_for_rate_limit()
             try:
-                async with self.session.get(url, timeout=10) as response:
+                async with self._sem, self.session.get(url, timeout=10) as response:
+                    self._note_rate_limit(response)
                     response.raise_for_status() # Will raise an exception for 4xx/5xx status
+                    if as_json:
+                        return _json_loads(await response.read())
                     return await response.text()
             except aiohttp.ClientError as e:
                 print(f"Attempt {attempt + 1} failed for {source}: {e}")
-                if attempt < 2:
+                # A 429 already set the pause from FMP's headers, so don't back off twice
+                rate_limited = isinstance(e, aiohttp.ClientResponseError) and e.status == 429
+                if attempt < 2 and not rate_limited:
                     await asyncio.sleep(2 ** attempt) # Exponential backoff
         return None
 
+    async def _fetch_news_source(self, source_name: str, url: str) -> List[str]:
+        """Fetch headlines from a single FMP news endpoint"""
+        print(f"Attempting to fetch from {source_name}...")
+        await self._wait_for_rate_limit()
+        try:
+            async with self._sem, self.session.get(url) as response:
+                print(f"Response status for {source_name}: {response.status}")
+                self._note_rate_limit(response)
+                response.raise_for_status()
+                data = _json_loads(await response.read())
+                
+                print(f"Data type for {source_name}: {type(data)}")
+                if data:
+                    print(f"First few items from {source_name}: {str(data)[:200]}...")
+                
+                if data and isinstance(data, list):
+                    headlines = [t for item in data if (t := item.get('title'))]
+                    print(f"✓ Fetched {len(headlines)} headlines from {source_name}")
+                    return headlines
+                elif data and isinstance(data, dict):
+                    # Some endpoints might return a dict with a 'data' or 'articles' key
+                    if 'data' in data:
+                        headlines = [t for item in data['data'] if (t := item.get('title'))]
+                        print(f"✓ Fetched {len(headlines)} headlines from {source_name} (dict format)")
+                        return headlines
+                    else:
+                        print(f"⚠ {source_name} returned dict but no 'data' key. Keys: {list(data.keys())}")
+                else:
+                    print(f"⚠ {source_name} returned unexpected format or empty data")
+                
+        except aiohttp.ClientResponseError as e:
+            print(f"✗ HTTP error fetching {source_name}: {e.status} - {e.message}")
+            if e.status == 403:
+                print(f"  → {source_name} might not be available on your FMP subscription tier")
+            elif e.status == 429:
+                print(f"  → Rate limited on {source_name}")
+        except aiohttp.ClientError as e:
+            print(f"✗ Client error fetching {source_name}: {e}")
+        except Exception as e:
+            print(f"✗ Unexpected error fetching {source_name}: {e}")
+        return []
+
     async def fetch_headlines(self) -> List[str]:
         """Fetch comprehensive financial and macroeconomic headlines from multiple FMP sources"""
         if not self.fmp_api_key:
             print("FMP API key not found.")
             return []
 
-        all_headlines = []
-        
         # Define multiple news sources for comprehensive coverage
         news_sources = {
             'stock_news': f"https://financialmodelingprep.com/stable/news/stock-latest?page=0&limit=100&apikey={self.fmp_api_key}",
@@ -65,67 +410,21 @@ class MarketDataCollector:
             'general_news': f"https://financialmodelingprep.com/stable/news/general-latest?page=0&limit=100&apikey={self.fmp_api_key}",
         }
         
-        # Fetch from each source
-        for source_name, url in news_sources.items():
-            print(f"Attempting to fetch from {source_name}...")
-            try:
-                async with self.session.get(url) as response:
-                    print(f"Response status for {source_name}: {response.status}")
-                    response.raise_for_status()
-                    data = await response.json()
-                    
-                    print(f"Data type for {source_name}: {type(data)}")
-                    if data:
-                        print(f"First few items from {source_name}: {str(data)[:200]}...")
-                    
-                    if data and isinstance(data, list):
-                        headlines = [item['title'] for item in data if 'title' in item and item['title']]
-                        all_headlines.extend(headlines)
-                        print(f"✓ Fetched {len(headlines)} headlines from {source_name}")
-                    elif data and isinstance(data, dict):
-                        # Some endpoints might return a dict with a 'data' or 'articles' key
-                        if 'data' in data:
-                            headlines = [item['title'] for item in data['data'] if 'title' in item and item['title']]
-                            all_headlines.extend(headlines)
-                            print(f"✓ Fetched {len(headlines)} headlines from {source_name} (dict format)")
-                        else:
-                            print(f"⚠ {source_name} returned dict but no 'data' key. Keys: {list(data.keys())}")
-                    else:
-                        print(f"⚠ {source_name} returned unexpected format or empty data")
-                    
-            except aiohttp.ClientResponseError as e:
-                print(f"✗ HTTP error fetching {source_name}: {e.status} - {e.message}")
-                if e.status == 403:
-                    print(f"  → {source_name} might not be available on your FMP subscription tier")
-                elif e.status == 429:
-                    print(f"  → Rate limited on {source_name}")
-                continue
-            except aiohttp.ClientError as e:
-                print(f"✗ Client error fetching {source_name}: {e}")
-                continue
-            except Exception as e:
-                print(f"✗ Unexpected error fetching {source_name}: {e}")
-                continue
+        # Fetch every source concurrently; each one handles its own errors
+        tasks = [self._fetch_news_source(name, url) for name, url in news_sources.items()]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        all_headlines = list(itertools.chain.from_iterable(r for r in results if isinstance(r, list)))
         
-        # Remove duplicates while preserving order
-        seen = set()
-        unique_headlines = []
-        for headline in all_headlines:
-            if headline and headline not in seen:
-                seen.add(headline)
-                unique_headlines.append(headline)
+        # Remove duplicates while preserving order (dicts keep insertion order),
+        # keeping up to 300 headlines for the AI to filter through
+        unique_headlines = list(itertools.islice(filter(None, dict.fromkeys(all_headlines)), 300))
         
         print(f"📊 Total unique headlines collected: {len(unique_headlines)}")
         
-        # Return up to 300 headlines for the AI to filter through
-        return unique_headlines[:300]
+        return unique_headlines
 
     async def fetch_yields(self) -> Dict[str, float]:
         """Fetch current treasury yields from FMP"""
-        return await asyncio.to_thread(self._fetch_yields_sync)
-
-    def _fetch_yields_sync(self) -> Dict[str, float]:
-        yields = {}
         symbols = {
             'US 13W': '^IRX',      # 13 Week Treasury Bill
             'US 5Y': '^FVX',      # 5 Year Treasury Note
@@ -133,112 +432,28 @@ class MarketDataCollector:
             'US 30Y': '^TYX',     # 30 Year Treasury Bond
         }
         try:
-            for name, symbol in symbols.items():
-                url = f"https://financialmodelingprep.com/api/v3/quote/{symbol}?apikey={self.fmp_api_key}"
-                response = requests.get(url)
-                response.raise_for_status()
-                data = response.json()
-                if data:
-                    yields[name] = data[0].get('price')
-            return yields
+            # One batched quote request instead of one round-trip per symbol
+            url = f"https://financialmodelingprep.com/api/v3/quote/{','.join(symbols.values())}?apikey={self.fmp_api_key}"
+            data = await self._fetch_with_retry(url, "yields", as_json=True)
+            prices = {item['symbol']: item.get('price') for item in data or []}
+            # Map symbols back to friendly names, keeping the order above
+            return {name: prices[symbol] for name, symbol in symbols.items() if symbol in prices}
         except Exception as e:
             print(f"Error fetching yields from FMP: {e}")
             return {}
 
     async def fetch_benchmarks(self) -> Dict[str, Dict[str, Any]]:
         """Fetch major market benchmarks from FMP"""
-        return await asyncio.to_thread(self._fetch_benchmarks_sync)
-
-    def _fetch_benchmarks_sync(self) -> Dict[str, Dict[str, Any]]:
         benchmarks = {}
-        symbols = [
-            # US Major Indices
-            '^GSPC',    # S&P 500
-            '^DJI',     # Dow Jones Industrial Average
-            '^IXIC',    # NASDAQ Composite
-            '^RUT',     # Russell 2000
-            '^VIX',     # Volatility Index
-            'SPY',     # S&P 500 ETF
-            
-
-            
-            # Global Indices
-            '^FTSE',    # FTSE 100 (UK)
-            '^N225',    # Nikkei 225 (Japan)
-            '^GDAXI',   # DAX (Germany)
-            '^FCHI',    # CAC 40 (France)
-            '^HSI',     # Hang Seng (Hong Kong)
-            '^AXJO',    # ASX 200 (Australia)
-            '^BVSP',    # Bovespa (Brazil)
-            '^MXX',     # IPC Mexico
-            
-            # Sector ETFs
-            'XLF',      # Financial Select Sector SPDR
-            'XLK',      # Technology Select Sector SPDR
-            'XLE',      # Energy Select Sector SPDR
-            'XLV',      # Health Care Select Sector SPDR
-            'XLI',      # Industrial Select Sector SPDR
-            'XLP',      # Consumer Staples Select Sector SPDR
-            'XLY',      # Consumer Discretionary Select Sector SPDR
-            'XLU',      # Utilities Select Sector SPDR
-            'XLRE',     # Real Estate Select Sector SPDR
-            'XLB',      # Materials Select Sector SPDR
-            
-            # Commodities
-            'CL=F',     # Crude Oil WTI
-            'BZ=F',     # Brent Crude Oil
-            'NG=F',     # Natural Gas
-            'GC=F',     # Gold
-            'SI=F',     # Silver
-            'HG=F',     # Copper
-            'PL=F',     # Platinum
-            'PA=F',     # Palladium
-            'ZC=F',     # Corn
-            'ZW=F',     # Wheat
-            'ZS=F',     # Soybeans
-            
-            # Currencies
-            'EURUSD=X', # EUR/USD
-            'GBPUSD=X', # GBP/USD
-            'USDJPY=X', # USD/JPY
-            'USDCAD=X', # USD/CAD
-            'AUDUSD=X', # AUD/USD
-            'USDCHF=X', # USD/CHF
-            'NZDUSD=X', # NZD/USD
-            'USDSEK=X', # USD/SEK
-            'USDNOK=X', # USD/NOK
-            'DX-Y.NYB', # US Dollar Index
-            
-            # Cryptocurrency
-            'BTC-USD',  # Bitcoin
-            'ETH-USD',  # Ethereum
-            'ADA-USD',  # Cardano
-            'SOL-USD',  # Solana
-
-            # Bonds & Fixed Income
-            'TLT',      # 20+ Year Treasury Bond ETF
-            'IEF',      # 7-10 Year Treasury Bond ETF
-            'SHY',      # 1-3 Year Treasury Bond ETF
-            'HYG',      # High Yield Corporate Bond ETF
-            'LQD',      # Investment Grade Corporate Bond ETF
-            'EMB',      # Emerging Markets Bond ETF
-            
-            # Alternative Assets
-            'REIT',     # iShares Core U.S. REIT ETF
-            'PDBC',     # Invesco Optimum Yield Diversified Commodity Strategy No K-1 ETF
-            'IAU',      # iShares Gold Trust
-            'SLV',      # iShares Silver Trust
-        ]
         try:
-            url = f"https://financialmodelingprep.com/api/v3/quote/{','.join(symbols)}?apikey={self.fmp_api_key}"
-            response = requests.get(url)
-            response.raise_for_status()
-            data = response.json()
-            for item in data:
+            url = f"https://financialmodelingprep.com/api/v3/quote/{_BENCHMARK_SYMBOLS_CSV}?apikey={self.fmp_api_key}"
+            data = await self._fetch_with_retry(url, "benchmarks", as_json=True)
+            for item in data or []:
                 benchmarks[item['name']] = {
                     'price': item.get('price'),
                     'change': item.get('change'),
-                    'change_pct': f"{item.get('changesPercentage', 0):.2f}"
+                    # FMP can send null here; it's formatted later, outside this try
+                    'change_pct': item.get('changesPercentage') or 0.0
                 }
             return benchmarks
         except Exception as e:
@@ -247,28 +462,29 @@ class MarketDataCollector:
 
     async def fetch_major_movers(self) -> List[Dict[str, Any]]:
         """Fetch top gainers and losers from FMP"""
-        return await asyncio.to_thread(self._fetch_major_movers_sync)
-
-    def _fetch_major_movers_sync(self) -> List[Dict[str, Any]]:
         movers = []
         
         # Try to get most active stocks and sort by biggest intraday moves
         try:
             # Get most active stocks (these often include the biggest intraday movers)
             actives_url = f"https://financialmodelingprep.com/api/v3/stock_market/actives?apikey={self.fmp_api_key}"
-            response = requests.get(actives_url)
-            response.raise_for_status()
-            actives_data = response.json()
+            actives_data = await self._fetch_with_retry(actives_url, "actives", as_json=True)
             
             if actives_data:
-                # Sort by absolute percentage change to get biggest movers
-                sorted_by_change = sorted(actives_data[:50], 
-                                        key=lambda x: abs(x.get('changesPercentage', 0)), 
-                                        reverse=True)
+                # Sort by absolute percentage change to get biggest movers,
+                # reading each item's change only once
+                by_change = [(item.get('changesPercentage', 0), item) for item in actives_data[:50]]
+                by_change.sort(key=lambda pair: abs(pair[0]), reverse=True)
                 
-                # Separate into gainers and losers, taking top 10 of each
-                gainers = [item for item in sorted_by_change if item.get('changesPercentage', 0) > 0][:10]
-                losers = [item for item in sorted_by_change if item.get('changesPercentage', 0) < 0][:10]
+                # Separate into gainers and losers in one pass, taking top 10 of each
+                gainers, losers = [], []
+                for pct, item in by_change:
+                    if pct > 0 and len(gainers) < 10:
+                        gainers.append(item)
+                    elif pct < 0 and len(losers) < 10:
+                        losers.append(item)
+                    if len(gainers) == 10 and len(losers) == 10:
+                        break
                 
                 # Add gainers
                 for item in gainers:
@@ -304,11 +520,12 @@ class MarketDataCollector:
             'losers': f"https://financialmodelingprep.com/api/v3/stock_market/losers?apikey={self.fmp_api_key}"
         }
         try:
-            for move_type, url in urls.items():
-                response = requests.get(url)
-                response.raise_for_status()
-                data = response.json()
-                for item in data[:10]:
+            # The two lists are independent, so fetch them concurrently
+            results = await asyncio.gather(
+                *(self._fetch_with_retry(url, move_type, as_json=True) for move_type, url in urls.items())
+            )
+            for move_type, data in zip(urls, results):
+                for item in (data or [])[:10]:
                     movers.append({
                         'symbol': item['symbol'],
                         'name': item['name'],
@@ -321,6 +538,25 @@ class MarketDataCollector:
             return []
 
 
+_markdown = None
+
+
+def _render_markdown(text: str) -> str:
+    """Convert markdown to HTML, building the mistune renderer on first use"""
+    global _markdown
+    if _markdown is None:
+        # Imported here since rendering happens once, after all the network I/O
+        import mistune
+        # Tables and fenced code blocks for better formatting; hard_wrap keeps
+        # single newlines as line breaks, and raw HTML is passed through
+        _markdown = mistune.create_markdown(
+            escape=False,
+            hard_wrap=True,
+            plugins=["table", "strikethrough"],
+        )
+    return _markdown(text)
+
+
 class MarketResearchAgent:
     """Main agent that coordinates data collection and analysis"""
     
@@ -340,15 +576,19 @@ class MarketResearchAgent:
         )
         
         self.current_llm = self.primary_llm  # Start with primary model
+        
+        # Wire both chains once instead of on every analysis
+        self.prompt_template = _PROMPT_TEMPLATE
+        self.primary_chain = self.prompt_template | self.primary_llm | StrOutputParser()
+        self.fallback_chain = self.prompt_template | self.fallback_llm | StrOutputParser()
 
-    async def _try_llm_with_fallback(self, chain, input_data, max_retries=2):
+    async def _try_llm_with_fallback(self, input_data, max_retries=2):
         """Try the primary LLM, fall back to secondary if it fails"""
         
         # Try primary model first
         try:
             print("🤖 Attempting analysis with primary model (openai/gpt-oss-120b)...")
-            primary_chain = LLMChain(llm=self.primary_llm, prompt=chain.prompt)
-            response = await primary_chain.ainvoke(input_data)
+            response = await self.primary_chain.ainvoke(input_data)
             print("✅ Primary model succeeded")
             return response
             
@@ -357,8 +597,7 @@ class MarketResearchAgent:
             print("🔄 Falling back to llama-3.3-70b-versatile...")
             
             try:
-                fallback_chain = LLMChain(llm=self.fallback_llm, prompt=chain.prompt)
-                response = await fallback_chain.ainvoke(input_data)
+                response = await self.fallback_chain.ainvoke(input_data)
                 print("✅ Fallback model succeeded")
                 return response
                 
@@ -407,77 +646,28 @@ class MarketResearchAgent:
             return error_message
 
         # Format data for the prompt
+        headlines_text = "\n".join(headlines) if headlines else "Data not available."
         formatted_yields = "\n".join([f"{name}: {value:.2f}%" for name, value in yields.items()]) if yields else "Data not available."
-        formatted_benchmarks = "\n".join([f"- {name}: {details['price']} ({details['change_pct']} %)" for name, details in benchmarks.items()]) if benchmarks else "Data not available."
+        formatted_benchmarks = "\n".join(f"- {name}: {details['price']} ({details['change_pct']:.2f} %)" for name, details in benchmarks.items()) if benchmarks else "Data not available."
         formatted_movers = "\n".join([f"- {mover['name']} ({mover['symbol']}): {mover['change_pct']} ({mover['type']})" for mover in movers]) if movers else "Data not available."
 
-        prompt_template = ChatPromptTemplate.from_template(
-            """You are a genius, insightful financial analyst with years of experience providing a morning market briefing for {current_date}. Your tone should be conversational yet informative, like a pro talking to colleagues.
-
-**Crucial Instructions:**
-- **DO NOT HALLUCINATE.** Use ONLY the data provided below. Do not invent facts, figures, or news.
-- If data for a section is unavailable, state "Data not available."
-- Your analysis must be insightful, connecting different data points.
-- The News section is critical. It should be the most in-depth, discussing 15-25 most important and interesting headlines (MAXIMUM 25 HEADLINES) DO NOT LIST MORE THAN 25 HEADLINES UNDER ANY CIRCUMSTANCE. DO NOT include earnings call transcripts in this section, or any other transcripts, we want interesting macro and market headlines.
-- Please try to include current prices for the major indices IF AVAILABLE.
-
-TO REPEAT:
-- NO EARNINGS CALL TRANSCRIPTS IN THE NEWS SECTION UNDER ANY CIRCUMSTANCE. IF IT HAS "earnings call transcript" OR SIMILAR IN THE HEADLINE DO NOT INCLUDE IT.
-- MAXIMUM 25 HEADLINES, CAREFULLY SELECT THE MOST INTERESTING AND IMPORTANT HEADLINES
-- Try to keep headlines that are most important and interesting to economic markets and geopolitics.
-
-WHEN DECIDING WHICH HEADLINES TO INCLUDE, CONSIDER THE FOLLOWING:
-- Is it a fact or opinion? Prioritize facts
-- Is it relevant to the market? Prioritize market-relevant news
-- Is it related to geopolitics and macroeconomic trends? Prioritize geopolitical news
-- Is it related to technology and innovation? Prioritize technology news
-- Is it related to consumer behavior and trends? Prioritize consumer news
-- Is it related to the economy and economy? Prioritize economy news
-AVOID:
-- Headlines that are questions
-- Headlines that don't necessarily highlight any market-moving information
-
-**Market Data for your analysis:**
-- **Headlines:**
-{headlines}
-- **Treasury Yields:**
-{formatted_yields}
-- **Market Benchmarks:**
-{formatted_benchmarks}
-- **MAJOR MOVERS:**
-{formatted_movers}
-
-**CRITICAL: You MUST use these EXACT section headers in your response:**
-- **📈 Markets:**
-- **📰 Top News:**
-- **🚀 Major Movers 📉:**
-- **💡 Key Takeaways:**
-- **📊 Overall Sentiment:**
-
-Please provide a detailed report in the style of a professional market briefing. Please avoid using charts or diagrams, instead just use markdown / plain speech.
-
-        """
-        )
-        
-        chain = LLMChain(llm=self.current_llm, prompt=prompt_template)
-        
         try:
             # Using ainvoke which is the new standard for async calls
             input_data = {
                 "current_date": datetime.now().strftime("%A, %B %d, %Y"),
-                "headlines": "\n".join(headlines) if headlines else "Data not available.",
+                "headlines": headlines_text,
                 "formatted_yields": formatted_yields,
                 "formatted_benchmarks": formatted_benchmarks,
                 "formatted_movers": formatted_movers
             }
-            response = await self._try_llm_with_fallback(chain, input_data)
-            # The response from ainvoke is a dictionary, we need to get the 'text' key
-            analysis = response.get('text', 'Error: Could not generate analysis.')
+            analysis = await self._try_llm_with_fallback(input_data) or 'Error: Could not generate analysis.'
             
-            # Debugging the final prompt and response
-            final_prompt = prompt_template.format(**input_data)
-            print("\n--- Final Prompt Sent to AI ---\n")
-            print(final_prompt)
+            # Debugging the final prompt and response; re-rendering the prompt
+            # is a full template pass, so only do it when asked to
+            if os.environ.get('DEBUG_PROMPT'):
+                final_prompt = self.prompt_template.format(**input_data)
+                print("\n--- Final Prompt Sent to AI ---\n")
+                print(final_prompt)
             print("\n--- AI Response ---\n")
             print(analysis)
             
@@ -488,149 +678,24 @@ Please provide a detailed report in the style of a professional market briefing.
             print(error_message)
             return error_message
 
+    def render(self, analysis: str) -> Dict[str, str]:
+        """Render the analysis once into the payload for each notification channel"""
+        return {
+            "subject": "Daily Market Research Report",
+            "html": self.format_email_content(analysis),
+            # Slack renders the markdown itself, so it gets the raw analysis
+            "slack": analysis,
+        }
+
     def format_email_content(self, analysis: str) -> str:
         """Formats the AI analysis into a professional HTML email."""
         # Convert markdown analysis to HTML
-        # Using extras for better formatting, like tables and fenced code blocks
-        content_html = markdown2.markdown(
-            analysis, 
-            extras=["tables", "fenced-code-blocks", "cuddled-lists", "break-on-newline"]
-        )
+        content_html = _render_markdown(analysis)
 
         # Get the current date for the email subject and header
         current_date_str = datetime.now().strftime("%B %d, %Y")
         
-        html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>Market Research Report</title>
-            <style>
-                body {{
-                    font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, Oxygen, Ubuntu, Cantarell, sans-serif;
-                    line-height: 1.6;
-                    color: #333;
-                    max-width: 800px;
-                    margin: 0 auto;
-                    padding: 20px;
-                    background-color: #f8f9fa;
-                }}
-                .header {{
-                    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                    color: white;
-                    padding: 30px;
-                    border-radius: 10px;
-                    text-align: center;
-                    margin-bottom: 30px;
-                    box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-                }}
-                .header h1 {{
-                    margin: 0;
-                    font-size: 28px;
-                    font-weight: 600;
-                }}
-                .header .date {{
-                    margin: 10px 0 0 0;
-                    font-size: 16px;
-                    opacity: 0.9;
-                }}
-                .content {{
-                    background: white;
-                    border-radius: 10px;
-                    padding: 30px;
-                    box-shadow: 0 2px 4px rgba(0, 0, 0, 0.1);
-                }}
-                .section {{
-                    margin-bottom: 30px;
-                    border-left: 4px solid #e9ecef;
-                    padding-left: 20px;
-                }}
-                .markets-section {{
-                    border-left-color: #28a745;
-                }}
-                .news-section {{
-                    border-left-color: #007bff;
-                }}
-                .movers-section {{
-                    border-left-color: #ffc107;
-                }}
-                .takeaways-section {{
-                    border-left-color: #17a2b8;
-                }}
-                .sentiment-section {{
-                    border-left-color: #6f42c1;
-                }}
-                .section-header {{
-                    color: #2c3e50;
-                    font-size: 20px;
-                    font-weight: 600;
-                    margin: 0 0 15px 0;
-                    padding-bottom: 8px;
-                    border-bottom: 2px solid #e9ecef;
-                }}
-                .section-content {{
-                    font-size: 14px;
-                }}
-                .market-item {{
-                    background: #f8f9fa;
-                    padding: 8px 12px;
-                    margin: 5px 0;
-                    border-radius: 5px;
-                    font-family: 'Monaco', 'Menlo', monospace;
-                    font-size: 13px;
-                    border-left: 3px solid #28a745;
-                }}
-                .bullet-point {{
-                    margin: 8px 0;
-                    padding-left: 15px;
-                    position: relative;
-                }}
-                .bullet-point:before {{
-                    content: "•";
-                    color: #007bff;
-                    font-weight: bold;
-                    position: absolute;
-                    left: 0;
-                }}
-                .content-paragraph {{
-                    margin: 12px 0;
-                    line-height: 1.7;
-                }}
-                .footer {{
-                    text-align: center;
-                    margin-top: 30px;
-                    padding: 20px;
-                    background: #f8f9fa;
-                    border-radius: 10px;
-                    font-size: 12px;
-                    color: #6c757d;
-                }}
-                .footer a {{
-                    color: #007bff;
-                    text-decoration: none;
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="header">
-                <h1>📊 Market Research Report</h1>
-                <div class="date">{current_date_str}</div>
-            </div>
-            
-            <div class="content">
-                {content_html}
-            </div>
-            
-            <div class="footer">
-                <p>This report was generated automatically by your Market Research Agent.</p>
-                <p>Powered by Financial Modeling Prep API & Groq AI</p>
-            </div>
-        </body>
-        </html>
-        """
-        return html
+        return _EMAIL_TEMPLATE.format(content_html=content_html, current_date_str=current_date_str)
 
 
 async def main():
@@ -6,12 +6,24 @@ Can be executed manually or via GitHub Actions
 
 import asyncio
 import sys
+import traceback
 from datetime import datetime
 from market_research_agent import MarketResearchAgent
-from email_sender import EmailSender
+from email_sender import EmailCfg, EmailSender
 from slack_sender import SlackSender
+from http_client import close_session
 import os
 
+# libuv-backed event loop for the I/O-heavy collector; winloop is the Windows
+# equivalent, and the stdlib loop is used when neither is installed
+try:
+    import uvloop as fast_loop
+except ImportError:
+    try:
+        import winloop as fast_loop
+    except ImportError:
+        fast_loop = None
+
 
 async def main():
     """Run the complete market research workflow"""
@@ -20,8 +32,14 @@ async def main():
     print(f"{'='*50}\n")
     
     try:
-        # Initialize agent
+        # Initialize agent and email sender. Email may be left unconfigured when
+        # Slack is set up; with neither, EmailSender raises before the analysis runs
         agent = MarketResearchAgent()
+        email_cfg = EmailCfg.from_env()
+        if email_cfg.has_transport or not os.getenv("SLACK_BOT_TOKEN"):
+            email_sender = EmailSender(email_cfg)
+        else:
+            email_sender = None
         
         # Collect and analyze market data
         print("Starting market analysis...")
@@ -30,10 +48,10 @@ async def main():
         
         # --- Notifications --- #
         print("Sending notifications...")
-        email_content = agent.format_email_content(analysis)  # Convert to beautifully formatted HTML
-        email_sender = EmailSender()
-        subject = "Daily Market Research Report"
-        if email_sender.send(subject, email_content):
+        rendered = agent.render(analysis)  # Convert to beautifully formatted HTML
+        if email_sender is None:
+            print("ℹ Email notification skipped (not configured)")
+        elif email_sender.send(rendered["subject"], rendered["html"]):
             print("✓ Email sent successfully")
         else:
             print("✗ Failed to send email")
@@ -41,7 +59,7 @@ async def main():
         # Send to Slack (if configured)
         slack_sender = SlackSender()
         if os.getenv("SLACK_BOT_TOKEN"):
-            if slack_sender.send(analysis):
+            if await slack_sender.send_async(rendered["slack"]):
                 print("✓ Slack message sent successfully")
             else:
                 print("✗ Failed to send Slack message")
@@ -65,11 +83,15 @@ async def main():
         
     except Exception as e:
         print(f"\n✗ Error running market research: {e}")
-        import traceback
         traceback.print_exc()
         return 1
+    
+    finally:
+        # The loop closes when main() returns, so release pooled connections first
+        await close_session()
 
 
 if __name__ == "__main__":
-    exit_code = asyncio.run(main())
+    run = fast_loop.run if fast_loop else asyncio.run
+    exit_code = run(main())
     sys.exit(exit_code)
\ No newline at end of file
@@ -3,38 +3,425 @@ Slack integration for market research reports
 """
 
 import os
-from datetime import datetime
-from dotenv import load_dotenv
-from slack_sdk import WebClient
+import asyncio
+import atexit
+import hashlib
+import json
+import logging
+import queue
+import random
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import closing
+from typing import Awaitable, Callable, Dict, List, Optional
+from datetime import date
+from env import load_env
+from slack_sdk.web.async_client import AsyncWebClient
 from slack_sdk.errors import SlackApiError
+from slack_sdk.http_retry.builtin_async_handlers import (
+    AsyncConnectionErrorRetryHandler,
+    AsyncRateLimitErrorRetryHandler,
+)
+from http_client import get_session
 
-load_dotenv()
+load_env()
+
+
+class _TokenBucketFilter(logging.Filter):
+    """Admits at most `rate` records per `per` seconds so error storms can't flood the output"""
+    
+    def __init__(self, rate: int = 5, per: float = 1.0):
+        super().__init__()
+        self.rate = rate
+        self.per = per
+        self._tokens = float(rate)
+        self._last = time.monotonic()
+        self._dropped = 0
+        self._lock = threading.Lock()
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate / self.per)
+            self._last = now
+            if self._tokens < 1:
+                self._dropped += 1
+                return False
+            self._tokens -= 1
+            dropped, self._dropped = self._dropped, 0
+        if dropped:
+            record.msg = f"{record.getMessage()} ({dropped} earlier messages suppressed)"
+            record.args = None
+        return True
+
+
+log = logging.getLogger(__name__)
+log.addFilter(_TokenBucketFilter())
+
+# Sync sends arriving close together are coalesced into one post; SLACK_BATCH=0 disables
+_BATCHING = os.getenv("SLACK_BATCH", "1") != "0"
+
+# Slack rejects text over 40,000 chars; leave room for the header and code fences
+_CHUNK = 38000
+
+# Channel names (#foo) resolve to IDs through conversations.list, which is heavily
+# rate limited, so the result is cached on disk across runs
+_CHANNEL_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "news-agent", "slack_channel.json")
+_CHANNEL_TTL = 600
+
+# Hashes of reports already delivered, so cron retries and manual re-runs don't repost
+_SENT_DB = os.path.join(os.path.expanduser("~"), ".cache", "news-agent", "sent.sqlite3")
+_SENT_TTL = 24 * 60 * 60
+
+# Runs of 3+ (possibly space-only) line breaks, or trailing spaces before a line break
+_WS = re.compile(r'(?:[ \t]*\n){3,}|[ \t]+\n')
+
+# [date, formatted] shared by all senders; the header date only changes at midnight
+_DATE_CACHE = [None, None]
+
+# Background sends for enqueue(); four workers keep us well inside Slack's rate limits
+_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="slack-send")
+
+# Strong references to fire-and-forget sends so they aren't garbage collected mid-flight
+_PENDING = set()
+
+
+def _split(text: str, limit: int = _CHUNK) -> List[str]:
+    """Split text into pieces of at most limit chars, preferring newline boundaries"""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    chunks.append(text)
+    return chunks
+
+
+def _read_channel_cache() -> dict:
+    """Return the cached {name: {"id", "expires_at"}} mapping, or {} if unreadable"""
+    try:
+        with open(_CHANNEL_CACHE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_channel_cache(name: str, channel_id: str):
+    entries = _read_channel_cache()
+    entries[name] = {"id": channel_id, "expires_at": time.time() + _CHANNEL_TTL}
+    try:
+        os.makedirs(os.path.dirname(_CHANNEL_CACHE), exist_ok=True)
+        with open(_CHANNEL_CACHE, "w") as f:
+            json.dump(entries, f)
+    except OSError:
+        # The cache is an optimization; resolution simply repeats next run
+        pass
+
+
+_SENT_DB_READY = False
+_SENT_DB_LOCK = threading.Lock()
+
+
+def _sent_db() -> sqlite3.Connection:
+    """Open the sent-report cache, creating its directory and table on first use"""
+    global _SENT_DB_READY
+    if not _SENT_DB_READY:
+        with _SENT_DB_LOCK:
+            if not _SENT_DB_READY:
+                os.makedirs(os.path.dirname(_SENT_DB), exist_ok=True)
+                with closing(sqlite3.connect(_SENT_DB, timeout=5)) as conn, conn:
+                    conn.execute("CREATE TABLE IF NOT EXISTS sent (key TEXT PRIMARY KEY, ts INTEGER)")
+                _SENT_DB_READY = True
+    return sqlite3.connect(_SENT_DB, timeout=5)
+
+
+def _already_sent(key: str) -> bool:
+    try:
+        with closing(_sent_db()) as conn:
+            row = conn.execute("SELECT 1 FROM sent WHERE key = ? AND ts > ?",
+                               (key, int(time.time()) - _SENT_TTL)).fetchone()
+    except (sqlite3.Error, OSError):
+        # Without the cache we just risk a duplicate post
+        return False
+    return row is not None
+
+
+def _mark_sent(key: str):
+    now = int(time.time())
+    try:
+        with closing(_sent_db()) as conn, conn:
+            conn.execute("DELETE FROM sent WHERE ts <= ?", (now - _SENT_TTL,))
+            conn.execute("INSERT OR REPLACE INTO sent (key, ts) VALUES (?, ?)", (key, now))
+    except (sqlite3.Error, OSError):
+        pass
+
+
+class _BackoffRateLimitHandler(AsyncRateLimitErrorRetryHandler):
+    """Retries 429s after Retry-After (or exponential backoff) plus jitter, and logs each wait"""
+    
+    async def prepare_for_next_attempt_async(self, *, state, request, response=None, error=None):
+        if response is None:
+            raise error
+        attempt = state.current_attempt
+        retry_after = next((v for k, v in response.headers.items() if k.lower() == "retry-after"), None)
+        delay = float(retry_after[0]) if retry_after else float(2 ** attempt)
+        delay += random.uniform(0, 0.25 * 2 ** attempt)
+        log.warning("Slack rate limited; retry %d/%d in %.2fs", attempt + 1, self.max_retry_count, delay)
+        state.next_attempt_requested = True
+        await asyncio.sleep(delay)
+        state.increment_current_attempt()
+
+
+# One client (and its retry handlers) per event loop, riding on that loop's shared
+# session; aiohttp sessions can't be used from another loop, so clients aren't shared
+_CLIENTS: Dict[asyncio.AbstractEventLoop, AsyncWebClient] = {}
+_CLIENT_LOCK = threading.Lock()
+
+
+def _get_client() -> AsyncWebClient:
+    """Return the Slack client for the running event loop, creating it if needed"""
+    loop = asyncio.get_running_loop()
+    session = get_session()
+    client = _CLIENTS.get(loop)
+    if client is None or client.session is not session:
+        client = AsyncWebClient(
+            token=os.getenv('SLACK_BOT_TOKEN'),
+            session=session,
+            timeout=10,
+            retry_handlers=[
+                AsyncConnectionErrorRetryHandler(),
+                _BackoffRateLimitHandler(max_retry_count=8),
+            ],
+        )
+        with _CLIENT_LOCK:
+            # Forget clients whose loops have already been closed
+            for stale_loop in [stale for stale in _CLIENTS if stale.is_closed()]:
+                del _CLIENTS[stale_loop]
+            _CLIENTS[loop] = client
+    return client
+
+
+# Synchronous sends run on one long-lived loop, so its pooled Slack connections
+# stay open between calls instead of being rebuilt by asyncio.run each time
+_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_LOOP_THREAD: Optional[threading.Thread] = None
+_LOOP_LOCK = threading.Lock()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _LOOP, _LOOP_THREAD
+    if _LOOP is None:
+        with _LOOP_LOCK:
+            if _LOOP is None:
+                loop = asyncio.new_event_loop()
+                _LOOP_THREAD = threading.Thread(target=loop.run_forever, name="slack-loop", daemon=True)
+                _LOOP_THREAD.start()
+                _LOOP = loop
+    return _LOOP
+
+
+@atexit.register
+def _stop_loop():
+    # Stop (without closing) so http_client's exit hook can close the session on it
+    if _LOOP is not None:
+        _LOOP.call_soon_threadsafe(_LOOP.stop)
+        _LOOP_THREAD.join(timeout=2)
+
+
+def _run_sync(coro: Awaitable[bool]) -> bool:
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop()).result()
+
+
+class _Batcher:
+    """Collects analyses for up to max_delay seconds and posts them as one message"""
+    
+    def __init__(self, post: Callable[[str], Awaitable[bool]],
+                 max_size: int = 10, max_delay: float = 0.5):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self._post = post
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, name="slack-batcher", daemon=True).start()
+    
+    def submit(self, analysis: str) -> Future:
+        future = Future()
+        self._queue.put((analysis, future))
+        return future
+    
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            # Close and reopen the code fence between reports
+            text = "```\n\n```".join(analysis for analysis, _ in batch)
+            try:
+                ok = _run_sync(self._post(text))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for _, future in batch:
+                    future.set_result(ok)
+
+
+_BATCHER: Optional[_Batcher] = None
+_BATCHER_LOCK = threading.Lock()
+
+
+def _send_disabled(analysis: str) -> bool:
+    return False
+
+
+async def _send_async_disabled(analysis: str) -> bool:
+    return False
 
 
 class SlackSender:
     """Handles sending messages to Slack"""
     
+    _HEADER_FMT = "*Market Research Report - %s*\n\n```%s```"
+    
     def __init__(self):
-        self.client = WebClient(token=os.getenv('SLACK_BOT_TOKEN'))
-        self.channel = os.getenv('SLACK_CHANNEL')
+        # SLACK_CHANNEL may be a comma-separated list; every channel gets the report
+        self.channels = [c.strip() for c in os.getenv('SLACK_CHANNEL', '').split(',') if c.strip()]
+        
+        # Check configuration once; an unconfigured sender gets no-op send methods
+        self._disabled = not (os.getenv('SLACK_BOT_TOKEN') and self.channels)
+        if self._disabled:
+            self.send = _send_disabled
+            self.send_async = _send_async_disabled
+
+    def _format_message(self, analysis: str) -> str:
+        today = date.today()
+        if _DATE_CACHE[0] != today:
+            # A race here only costs a redundant strftime
+            _DATE_CACHE[1] = today.strftime('%B %d, %Y')
+            _DATE_CACHE[0] = today
+        return self._HEADER_FMT % (_DATE_CACHE[1], analysis)
 
     def send(self, analysis: str) -> bool:
-        """Sends the market analysis text to a Slack channel"""
-        if not self.client.token or not self.channel:
-            return False
+        """Sends the market analysis text to a Slack channel
         
+        Blocks until delivered when called outside an event loop; inside a
+        running loop the send is scheduled in the background and True is returned.
+        """
         try:
-            message_text = f"*Market Research Report - {datetime.now().strftime('%B %d, %Y')}*\n\n```{analysis}```"
+            asyncio.get_running_loop()
+        except RuntimeError:
+            if _BATCHING:
+                return self._get_batcher().submit(analysis).result()
+            return _run_sync(self.send_async(analysis))
+        
+        if _BATCHING:
+            self._get_batcher().submit(analysis)
+            return True
+        task = asyncio.get_running_loop().create_task(self.send_async(analysis))
+        _PENDING.add(task)
+        task.add_done_callback(_PENDING.discard)
+        return True
+
+    def enqueue(self, analysis: str) -> Future:
+        """Sends the market analysis in the background; the Future resolves to send()'s result"""
+        if _BATCHING and not self._disabled:
+            return self._get_batcher().submit(analysis)
+        return _POOL.submit(self.send, analysis)
+
+    def _get_batcher(self) -> _Batcher:
+        global _BATCHER
+        if _BATCHER is None:
+            with _BATCHER_LOCK:
+                if _BATCHER is None:
+                    _BATCHER = _Batcher(self.send_async)
+        return _BATCHER
+
+    async def _resolve_channel(self, client: AsyncWebClient, channel: str) -> str:
+        """Return the ID for a #channel-name, using the on-disk cache when fresh"""
+        if not channel.startswith('#'):
+            return channel
+        name = channel[1:]
+        cached = _read_channel_cache().get(name)
+        if cached and cached["expires_at"] > time.time():
+            return cached["id"]
+        
+        try:
+            cursor = None
+            while True:
+                response = await client.conversations_list(
+                    exclude_archived=True,
+                    types='public_channel,private_channel',
+                    limit=1000,
+                    cursor=cursor
+                )
+                match = next((c["id"] for c in response["channels"] if c["name"] == name), None)
+                cursor = response.get("response_metadata", {}).get("next_cursor")
+                if match or not cursor:
+                    break
+        except Exception:
+            # Fall back to a stale ID rather than failing the send
+            if cached:
+                return cached["id"]
+            raise
+        
+        if not match:
+            return channel
+        _write_channel_cache(name, match)
+        return match
+
+    async def send_async(self, analysis: str) -> bool:
+        """Sends the market analysis to every channel without blocking the event loop"""
+        client = _get_client()
+        # LLM output is padded with blank lines and trailing spaces that only add payload
+        analysis = _WS.sub(lambda m: '\n\n' if m.group().count('\n') > 2 else '\n', analysis.strip())
+        chunks = _split(analysis)
+        results = await asyncio.gather(*(self._send_to(client, i, analysis, chunks) for i in range(len(self.channels))))
+        return all(results)
+
+    async def _send_to(self, client: AsyncWebClient, index: int,
+                       analysis: str, chunks: List[str]) -> bool:
+        try:
+            # Resolved IDs replace names so later sends skip the lookup
+            channel = self.channels[index] = await self._resolve_channel(client, self.channels[index])
+            key = hashlib.sha256(f"{channel}|{date.today()}|{analysis}".encode()).hexdigest()
+            # sqlite blocks (up to the 5s lock timeout), so keep it off the event loop
+            if await asyncio.to_thread(_already_sent, key):
+                log.info("Duplicate Slack report for %s suppressed", channel)
+                return True
             
-            response = self.client.chat_postMessage(
-                channel=self.channel,
-                text=message_text,
+            first, *rest = chunks
+            response = await client.chat_postMessage(
+                channel=channel,
+                text=self._format_message(first),
                 mrkdwn=True
             )
-            return response.get('ok', False)
+            # Oversized reports continue as replies in the first message's thread
+            for chunk in rest:
+                await client.chat_postMessage(
+                    channel=channel,
+                    thread_ts=response['ts'],
+                    text=f"```{chunk}```",
+                    mrkdwn=True
+                )
+            if response.get('ok', False):
+                await asyncio.to_thread(_mark_sent, key)
+                return True
+            return False
         except SlackApiError as e:
-            print(f"Error sending Slack message: {e.response['error']}")
+            log.error("Error sending Slack message: %s", e.response['error'])
             return False
-        except Exception as e:
-            print(f"Unexpected error sending Slack message: {e}")
+        except Exception:
+            log.exception("Unexpected error sending Slack message")
             return False
\ No newline at end of file